@@ -1,3 +1,4 @@
 from .models import *
 from .base import *
+from .listing import *
 from .loader import *
\ No newline at end of file
@@ -0,0 +1,193 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from string import digits, ascii_uppercase, ascii_lowercase
+from typing import Dict, Iterator, List, Tuple
+
+
+# Characters keys are probed with when the prefix has no subfolders,
+# Label Studio names annotation objects by their numeric id
+KEYSPACE_CHARACTERS = digits + ascii_uppercase + ascii_lowercase
+
+
+class S3PrefixLister:
+    """ Splits keys under a prefix into key ranges that can be listed independently
+
+        Shard i covers keys in (bounds[i-1], bounds[i]], the first and the last
+        shards are open-ended, so every key belongs to exactly one shard.
+        Bounds are taken from the real layout of the bucket by plan()
+    """
+    def __init__(self, client, bucket: str, prefix: str, workers: int = 16, characters: str = KEYSPACE_CHARACTERS):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.workers = workers
+        self.characters = characters
+
+        self.shards: List[Tuple[str | None, str | None]] = [(None, None)]
+
+    def plan(self):
+        """ Picks shard bounds: subfolders of the prefix, or first two characters of flat keys """
+        response = self._list_folders(self.prefix)
+
+        # s3://bucket/annotations means the annotations/ folder, descend into it
+        # and into any other folder that is the only thing in its parent
+        while len(folders := response['folders']) == 1 and not response['has_files']:
+            self.prefix = folders[0]
+            response = self._list_folders(self.prefix)
+
+        if len(folders) > 1:
+            bounds = folders
+        else:
+            bounds = self._two_character_bounds()
+
+        bounds = sorted(set(bounds))
+        self.shards = list(zip([None] + bounds, bounds + [None]))
+
+    def _list_folders(self, prefix: str) -> dict:
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=prefix, Delimiter='/')
+        return {
+            'folders': [common['Prefix'] for common in response.get('CommonPrefixes', [])],
+            'has_files': bool(response.get('Contents')),
+        }
+
+    def _two_character_bounds(self) -> List[str]:
+        """ Bounds at every pair of characters keys start with after the prefix
+
+            Leading characters are probed in parallel, the same set is used for the second
+            character. Numeric Label Studio ids give up to 100 bounds, or 81 when no id starts
+            with 0. Ranges aren't even: ids of different length are ordered as strings, so
+            shard sizes depend on the leading digits of the largest ids
+        """
+        def probe(char: str) -> bool:
+            response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=self.prefix + char, MaxKeys=1)
+            return bool(response.get('Contents'))
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            found = executor.map(probe, self.characters)
+            leading = [char for char, exists in zip(self.characters, found) if exists]
+
+        return [self.prefix + first + second for first in leading for second in leading]
+
+    def list_shard(self, shard: int, start_after: str | None = None) -> Iterator[List[Tuple[str, str]]]:
+        """ Yields pages of (key, etag) in shard, starting after start_after if it's given """
+        lower, upper = self.shards[shard]
+        if start_after is None or (lower is not None and start_after < lower):
+            start_after = lower
+
+        while True:
+            request = {'Bucket': self.bucket, 'Prefix': self.prefix}
+            if start_after is not None:
+                request['StartAfter'] = start_after
+            response = self.client.list_objects_v2(**request)
+
+            keys = [(content['Key'], content['ETag']) for content in response.get('Contents', [])]
+            reached_upper = False
+            if upper is not None and keys and keys[-1][0] > upper:
+                keys = [(key, etag) for key, etag in keys if key <= upper]
+                reached_upper = True
+
+            if keys:
+                yield keys
+            if reached_upper or not keys or not response.get('IsTruncated'):
+                return
+            start_after = keys[-1][0]
+
+
+class S3ListingCheckpoint:
+    """ Remembers the last finished key of every shard and the objects loaded so far
+
+        state.json keeps StartAfter keys per shard and whether the load finished,
+        annotations.jsonl keeps objects seen by the current load with their ETags.
+
+        An interrupted load continues after the saved StartAfter keys. A load that
+        finished is listed again from the start on the next run, objects of the
+        previous load are moved to previous.jsonl and reused only while their ETag
+        is unchanged, so edited annotations are fetched again and deleted ones dropped
+    """
+    def __init__(self, path: str | Path, url: str):
+        self.path = Path(path)
+        self.url = url
+        self.start_after: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._state_path = self.path / 'state.json'
+        self._data_path = self.path / 'annotations.jsonl'
+        self._previous_path = self.path / 'previous.jsonl'
+
+    def load(self) -> Tuple[Dict[str, Tuple[str, dict]], Dict[str, Tuple[str, dict]]]:
+        """ Returns objects seen by the current load and objects of the previous finished load,
+            both as key -> (etag, data)
+        """
+        if not self._state_path.exists():
+            self.reset()
+            return {}, {}
+
+        with open(self._state_path, mode='r', encoding='utf-8') as file:
+            state = json.load(file)
+        if state.get('url') != self.url:
+            print(f"Checkpoint is for {state.get('url')}, starting over")
+            self.reset()
+            return {}, {}
+
+        if state.get('complete'):
+            # start a new load, objects of the finished one are only reused by ETag
+            if self._data_path.exists():
+                self._data_path.replace(self._previous_path)
+            self.start_after = {}
+            self._save_state(complete=False)
+        else:
+            self.start_after = state['start_after']
+
+        return self._read_objects(self._data_path), self._read_objects(self._previous_path)
+
+    def reset(self):
+        self.start_after = {}
+        self._data_path.unlink(missing_ok=True)
+        self._previous_path.unlink(missing_ok=True)
+        self._state_path.unlink(missing_ok=True)
+
+    def commit(self, shard: str, objects: List[Tuple[str, str, dict]]):
+        """ Stores page of (key, etag, data) and moves shard's StartAfter to its last key """
+        with self._lock:
+            with open(self._data_path, mode='a', encoding='utf-8') as file:
+                for key, etag, data in objects:
+                    file.write(json.dumps({'key': key, 'etag': etag, 'data': data}, ensure_ascii=False) + '\n')
+
+            self.start_after[shard] = objects[-1][0]
+            self._save_state(complete=False)
+
+    def finish(self):
+        """ Marks load as finished, the next run lists everything again """
+        with self._lock:
+            self._save_state(complete=True)
+            self._previous_path.unlink(missing_ok=True)
+
+    def _save_state(self, complete: bool):
+        temp_path = self._state_path.with_suffix('.tmp')
+        with open(temp_path, mode='w', encoding='utf-8') as file:
+            json.dump({'url': self.url, 'start_after': self.start_after, 'complete': complete}, file)
+        temp_path.replace(self._state_path)
+
+    @staticmethod
+    def _read_objects(path: Path) -> Dict[str, Tuple[str, dict]]:
+        objects = {}
+        if path.exists():
+            with open(path, mode='r', encoding='utf-8') as file:
+                for line in file:
+                    # last line can be partial if previous run was killed mid-write
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    objects[record['key']] = (record['etag'], record['data'])
+        return objects
+
+
+__all__ = [
+    "KEYSPACE_CHARACTERS",
+    "S3PrefixLister",
+    "S3ListingCheckpoint"
+]
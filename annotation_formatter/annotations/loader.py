@@ -1,27 +1,69 @@
 import json
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from pathlib import Path
 
 from .models import *
 from s3 import S3Url, S3Context
 
 from .base import AnnotationLoader
+from .listing import S3PrefixLister, S3ListingCheckpoint
 
 
 class S3AnnotationLoader(AnnotationLoader):
-    def __init__(self, s3: S3Context):
+    def __init__(self, s3: S3Context, workers: int = 16, checkpoint_path: str | Path | None = None):
         self.s3 = s3
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
 
     def get_tasks(self, s3_url: str | S3Url):
         if isinstance(s3_url, str):
             s3_url = S3Url(s3_url)
 
+        # boto3 clients are thread safe unlike resources
+        client = self.s3.resource.meta.client
+        lister = S3PrefixLister(client, s3_url.bucket, s3_url.prefix, self.workers)
+        lister.plan()
+
+        # key -> (etag, data) of current load, and of the previous one if it's being refreshed
+        objects: Dict[str, Tuple[str, dict]] = {}
+        previous: Dict[str, Tuple[str, dict]] = {}
+        checkpoint = None
+        if self.checkpoint_path is not None:
+            checkpoint = S3ListingCheckpoint(self.checkpoint_path, f"s3://{s3_url.bucket}/{s3_url.prefix}")
+            objects, previous = checkpoint.load()
+
+        def fetch(key: str, etag: str) -> dict:
+            # objects that didn't change since the previous load aren't downloaded again
+            if (cached := previous.get(key)) is not None and cached[0] == etag:
+                return cached[1]
+            return self._download_json(client, s3_url.bucket, key)
+
+        # shards are listed in parallel, every listed page goes straight to the download pool
+        with ThreadPoolExecutor(self.workers) as downloads, \
+             ThreadPoolExecutor(min(self.workers, len(lister.shards))) as listings:
+            def load_shard(shard: int) -> List[Tuple[str, str, dict]]:
+                shard_key = lister.shards[shard][0] or ''
+                start_after = checkpoint.start_after.get(shard_key) if checkpoint else None
+
+                loaded = []
+                for keys in lister.list_shard(shard, start_after):
+                    futures = [downloads.submit(fetch, key, etag) for key, etag in keys]
+                    page = [(key, etag, future.result()) for (key, etag), future in zip(keys, futures)]
+                    if checkpoint:
+                        checkpoint.commit(shard_key, page)
+                    loaded.extend(page)
+                return loaded
+
+            for loaded in listings.map(load_shard, range(len(lister.shards))):
+                objects.update((key, (etag, data)) for key, etag, data in loaded)
+
+        if checkpoint:
+            checkpoint.finish()
+
         tasks: Dict[str, Task] = {}
-        bucket =  self.s3.resource.Bucket(s3_url.bucket)
-        for object_summary in bucket.objects.filter(Prefix=s3_url.prefix):
-            object = bucket.Object(object_summary.key)
-            data = self.s3.download_bytes(object)
-            data = json.loads(data)
+        for key in sorted(objects):
+            _, data = objects[key]
 
             task_data = data['task']
             if (task_id := task_data['id']) not in tasks:
@@ -30,6 +72,11 @@ class S3AnnotationLoader(AnnotationLoader):
             tasks[task_id].annotations.append(Annotation.from_json(data))
         return tasks.values()
 
+    @staticmethod
+    def _download_json(client, bucket: str, key: str) -> dict:
+        response = client.get_object(Bucket=bucket, Key=key)
+        return json.loads(response['Body'].read())
+
 
 class ExportAnnotationLoader(AnnotationLoader):
     def __init__(self):
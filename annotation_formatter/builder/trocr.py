@@ -1,74 +1,56 @@
 import io
 import csv
-from typing import List
+import dataclasses
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
-import cv2
-import numpy as np
-
-from annotations import Task
-from exporter import Exporter
+from annotations import Task, Annotation, Region
+from exporter import Exporter, open_streams
+from s3 import S3Context
 from .base import Builder
 
+# cv2 and numpy are slow to import, they're loaded only when crops are processed
+if TYPE_CHECKING:
+    import numpy as np
+
+
+@dataclasses.dataclass
+class CropConfig:
+    # resize crops to a fixed height keeping aspect ratio
+    height: int | None = None
+    # or fit them into (width, height) keeping aspect ratio and padding with white
+    size: Tuple[int, int] | None = None
+    grayscale: bool = False
+    # encoder to use: jpg, png or webp
+    format: str = 'jpg'
+    # jpg/webp quality (0-100) or png compression level (0-9), encoder default if None
+    quality: int | None = None
+
+    def __post_init__(self):
+        if self.height is not None and self.size is not None:
+            raise ValueError("Crop height and size are mutually exclusive")
+        if self.format not in ('jpg', 'png', 'webp'):
+            raise ValueError(f"Unknown image format {self.format}")
+
+        if self.height is not None and self.height <= 0:
+            raise ValueError(f"Crop height must be positive, got {self.height}")
+        if self.size is not None and min(self.size) <= 0:
+            raise ValueError(f"Crop size must be positive, got {self.size[0]}x{self.size[1]}")
+
+        if self.quality is not None:
+            max_quality = 9 if self.format == 'png' else 100
+            if not 0 <= self.quality <= max_quality:
+                raise ValueError(f"Quality of {self.format} must be in 0-{max_quality}, got {self.quality}")
+
 
 class TrOCRBuilder(Builder):
+    def __init__(self, s3_context: S3Context, crop_config: CropConfig | None = None):
+        super().__init__(s3_context)
+        self.crop_config = crop_config or CropConfig()
+
     def build_dataset(self, tasks: List[Task], exporters: List[Exporter]):
-        data = []
-
-        for task_data in tasks:
-            image_bytes = self.s3_context.download_bytes(task_data.image_url)
-            image_bytes = np.frombuffer(image_bytes, dtype=np.uint8)
-            image = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
-
-            for annotation in task_data.annotations:
-                for region_id, region in annotation.regions.items():
-                    print('Processing', region_id)
-
-                    # create contour out of label studio points
-                    image_height, image_width = image.shape[:2]
-                    contour = [[x / 100 * image_width, y / 100 * image_height] for x, y in region.points]
-                    contour = np.array(contour).reshape((-1,1,2)).astype(np.int32)
-
-                    # get contour bounding box
-                    x, y, w, h = cv2.boundingRect(contour)
-
-                    # create mask
-                    mask = np.zeros([image_height, image_width], dtype=np.uint8)
-                    cv2.fillPoly(mask, [contour], 255)
-                    
-                    # crop mask and image
-                    mask = mask[y:y+h, x:x+w]
-                    image_part = image[y:y+h, x:x+w]
-
-                    # mask shenanigans
-                    text_part = cv2.bitwise_and(image_part, image_part, mask=mask)
-                    white_bg = np.full_like(image_part, 255)
-                    white_part = cv2.bitwise_and(white_bg, white_bg, mask=cv2.bitwise_not(mask))
-
-                    image_part = cv2.add(text_part, white_part)
-
-                    # rotate image if it was rotated in Label Studio
-                    rotation_matrix = cv2.getRotationMatrix2D(
-                        np.array(image_part.shape[1::-1]) / 2,
-                        region.image_rotation,
-                        1.0
-                    )
-                    image_part = cv2.warpAffine(image_part, rotation_matrix, image_part.shape[1::-1], flags=cv2.INTER_CUBIC)
-
-                    # save image
-                    filename = f'{region_id}.jpg'
-                    _, image_buffer = cv2.imencode('.jpg', image_part)
-                    image_bytes = image_buffer.tobytes()
-
-                    for exporter in exporters:
-                        exporter.export_bytes(image_bytes, f"images/{region.id}.jpg")
-
-                    # add to data csv
-                    data.append({
-                        'image': filename,
-                        'text': region.text
-                    })
-        
-        with io.StringIO() as csv_file:
+        # csv rows are streamed to every exporter as regions get processed
+        with open_streams(exporters, 'data.csv') as csv_stream, \
+             io.TextIOWrapper(csv_stream, encoding='utf-8', newline='') as csv_file:
             csv_writer = csv.DictWriter(csv_file, 
                                         fieldnames=['image', 'text'], 
                                         delimiter=';', 
@@ -76,15 +58,141 @@ class TrOCRBuilder(Builder):
                                         escapechar='\\',
                                         quoting=csv.QUOTE_NONE)
             csv_writer.writeheader()
-            csv_writer.writerows(data)
-            csv_file.seek(0)
-            csv_data = csv_file.read()
-        
-        csv_bytes = csv_data.encode(encoding='utf-8')
-        for exporter in exporters:
-            exporter.export_bytes(csv_bytes, 'data.csv')
+
+            # group annotations by page, so every page is downloaded and decoded once
+            pages: Dict[str, List[Annotation]] = {}
+            for task_data in tasks:
+                pages.setdefault(task_data.image_url, []).extend(task_data.annotations)
+
+            for image_url, annotations in pages.items():
+                self._process_page(image_url, annotations, exporters, csv_writer)
+
+    def _process_page(self, image_url: str, annotations: List[Annotation], exporters: List[Exporter], csv_writer: csv.DictWriter):
+        import cv2
+        import numpy as np
+
+        regions = [region for annotation in annotations for region in annotation.regions.values()]
+        if not regions:
+            return
+
+        image_bytes = self.s3_context.download_bytes(image_url)
+        image_bytes = np.frombuffer(image_bytes, dtype=np.uint8)
+        image = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
+
+        # re-annotated regions often repeat the same geometry, those are cut and encoded once
+        encoded_crops: Dict[tuple, bytes] = {}
+        # path -> geometry of the crop it holds, a reused region id with other geometry is written again
+        exported_geometries: Dict[str, tuple] = {}
+
+        for region in regions:
+            print('Processing', region.id)
+
+            geometry = (tuple(map(tuple, region.points)), region.image_rotation)
+            if (image_bytes := encoded_crops.get(geometry)) is None:
+                image_part = self._cut_region(image, region)
+
+                # bring crop to the model input size once instead of every epoch
+                image_part = self._normalize_crop(image_part)
+                image_bytes = encoded_crops[geometry] = self._encode_crop(image_part)
+
+            # save image
+            filename = f'{region.id}.{self.crop_config.format}'
+            if exported_geometries.get(path := f"images/{filename}") != geometry:
+                for exporter in exporters:
+                    exporter.export_bytes(image_bytes, path)
+                exported_geometries[path] = geometry
+
+            # add to data csv
+            csv_writer.writerow({
+                'image': filename,
+                'text': region.text
+            })
+
+    def _cut_region(self, image: "np.ndarray", region: Region) -> "np.ndarray":
+        import cv2
+        import numpy as np
+
+        # create contour out of label studio points
+        image_height, image_width = image.shape[:2]
+        contour = [[x / 100 * image_width, y / 100 * image_height] for x, y in region.points]
+        contour = np.array(contour).reshape((-1,1,2)).astype(np.int32)
+
+        # get contour bounding box, clipped to the page
+        x, y, w, h = cv2.boundingRect(contour)
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + w, image_width), min(y + h, image_height)
+
+        # mask only the bounding box instead of the whole page
+        mask = np.zeros([bottom - top, right - left], dtype=np.uint8)
+        cv2.fillPoly(mask, [contour], 255, offset=(-left, -top))
+
+        # paint everything outside of region white
+        image_part = image[top:bottom, left:right].copy()
+        image_part[mask == 0] = 255
+
+        # rotate image if it was rotated in Label Studio
+        rotation_matrix = cv2.getRotationMatrix2D(
+            np.array(image_part.shape[1::-1]) / 2,
+            region.image_rotation,
+            1.0
+        )
+        return cv2.warpAffine(image_part, rotation_matrix, image_part.shape[1::-1], flags=cv2.INTER_CUBIC)
+
+    def _normalize_crop(self, image_part: "np.ndarray") -> "np.ndarray":
+        import cv2
+
+        config = self.crop_config
+
+        if config.grayscale:
+            image_part = cv2.cvtColor(image_part, cv2.COLOR_BGR2GRAY)
+
+        height, width = image_part.shape[:2]
+        if height == 0 or width == 0:
+            return image_part
+
+        if config.height is not None:
+            target_width, target_height = max(1, round(width * config.height / height)), config.height
+        elif config.size is not None:
+            scale = min(config.size[0] / width, config.size[1] / height)
+            target_width, target_height = max(1, round(width * scale)), max(1, round(height * scale))
+        else:
+            return image_part
+
+        interpolation = cv2.INTER_AREA if target_height < height else cv2.INTER_CUBIC
+        image_part = cv2.resize(image_part, (target_width, target_height), interpolation=interpolation)
+
+        # pad to the fixed size with white, keeping crop in the center
+        if config.size is not None:
+            pad_x, pad_y = config.size[0] - target_width, config.size[1] - target_height
+            image_part = cv2.copyMakeBorder(
+                image_part,
+                pad_y // 2, pad_y - pad_y // 2,
+                pad_x // 2, pad_x - pad_x // 2,
+                cv2.BORDER_CONSTANT,
+                value=(255, 255, 255)
+            )
+        return image_part
+
+    def _encode_crop(self, image_part: "np.ndarray") -> bytes:
+        import cv2
+
+        config = self.crop_config
+
+        params = []
+        if config.quality is not None:
+            match config.format:
+                case 'jpg':
+                    params = [cv2.IMWRITE_JPEG_QUALITY, config.quality]
+                case 'webp':
+                    params = [cv2.IMWRITE_WEBP_QUALITY, config.quality]
+                case 'png':
+                    params = [cv2.IMWRITE_PNG_COMPRESSION, config.quality]
+
+        _, image_buffer = cv2.imencode(f'.{config.format}', image_part, params)
+        return image_buffer.tobytes()
 
 
 __all__ = [
+    'CropConfig',
     'TrOCRBuilder'
 ]
@@ -1,2 +1,3 @@
 from .base import *
+from .stream import *
 from .exporter import *
\ No newline at end of file
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import BinaryIO, ContextManager
 
 
 class Exporter(ABC):
@@ -10,6 +11,13 @@ class Exporter(ABC):
     def export_file(self, file, path: str):
         pass
 
+    @abstractmethod
+    def open_stream(self, path: str) -> ContextManager[BinaryIO]:
+        """ Opens a writable binary stream to path, the artifact is finalized on exit
+            and discarded if the block raises
+        """
+        pass
+
 
 __all__ = [
     'Exporter'
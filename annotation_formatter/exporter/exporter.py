@@ -1,9 +1,12 @@
 import io
+import shutil
+import contextlib
 from pathlib import Path
 
 from s3 import S3Url, S3Context
 
 from .base import Exporter
+from .stream import S3MultipartStream
 
 
 class S3Exporter(Exporter):
@@ -25,12 +28,28 @@ class S3Exporter(Exporter):
         target_url = self._get_target_path(path)
         object = self.s3.url_to_object(target_url)
         object.upload_fileobj(file)
+
+    @contextlib.contextmanager
+    def open_stream(self, path: str):
+        target_url = self._get_target_path(path)
+        object = self.s3.url_to_object(target_url)
+
+        stream = S3MultipartStream(object)
+        try:
+            yield stream
+        except BaseException:
+            stream.abort()
+            raise
+        stream.commit()
     
     def _get_target_path(self,path) -> S3Url:
         return self.base_url / path
 
 
 class FolderExporter(Exporter):
+    # Size of write buffer for streamed files
+    BUFFER_SIZE = 1024 * 1024
+
     def __init__(self, base_path: Path):
         self.base_path = base_path.resolve()
     
@@ -42,11 +61,23 @@ class FolderExporter(Exporter):
             output_file.write(bytes)
 
     def export_file(self, input_file, path):
-        path = self.base_path / path
+        with self.open_stream(path) as output_file:
+            shutil.copyfileobj(input_file, output_file, self.BUFFER_SIZE)
+
+    @contextlib.contextmanager
+    def open_stream(self, path: str):
+        path = self._get_target_path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(path, 'w', encoding='utf-8') as output_file:
-            output_file.write(input_file.read())
+
+        # Write next to the target and swap it in only when the stream is complete
+        partial_path = path.with_name(path.name + '.part')
+        try:
+            with open(partial_path, 'wb', buffering=self.BUFFER_SIZE) as output_file:
+                yield output_file
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+        partial_path.replace(path)
     
     def _get_target_path(self, path) -> Path:
         return self.base_path / path
@@ -0,0 +1,109 @@
+import io
+import contextlib
+from typing import BinaryIO, Iterator, List
+
+from .base import Exporter
+
+
+# S3 requires every part except the last one to be at least 5 MiB
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3MultipartStream(io.RawIOBase):
+    """ Writable stream backed by an S3 multipart upload
+        Small artifacts that never fill a part are uploaded with a single put
+
+        Nothing is uploaded unless commit is called, closing the stream otherwise
+        (including when it's garbage collected) aborts the upload
+    """
+    def __init__(self, object, part_size: int = DEFAULT_PART_SIZE):
+        self.object = object
+        self.part_size = part_size
+
+        self._buffer = bytearray()
+        self._upload = None
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed stream")
+
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def commit(self):
+        """ Uploads the rest of the buffer, completes the upload and closes the stream """
+        if self.closed:
+            raise ValueError("commit of closed stream")
+
+        try:
+            if self._upload is None:
+                self.object.put(Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                self._upload.complete(MultipartUpload={'Parts': self._parts})
+        except BaseException:
+            self.abort()
+            raise
+
+        self._upload = None
+        self._buffer.clear()
+        super().close()
+
+    def close(self):
+        self.abort()
+
+    def abort(self):
+        if self.closed:
+            return
+
+        if self._upload is not None:
+            self._upload.abort()
+            self._upload = None
+        self._buffer.clear()
+        super().close()
+
+    def _upload_part(self, data: bytes):
+        if self._upload is None:
+            self._upload = self.object.initiate_multipart_upload()
+
+        part_number = len(self._parts) + 1
+        response = self._upload.Part(part_number).upload(Body=data)
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+
+class TeeStream(io.RawIOBase):
+    """ Writes everything to several streams at once, doesn't own them """
+    def __init__(self, streams: List[BinaryIO]):
+        self.streams = streams
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        for stream in self.streams:
+            stream.write(data)
+        return len(data)
+
+
+@contextlib.contextmanager
+def open_streams(exporters: List[Exporter], path: str) -> Iterator[BinaryIO]:
+    """ Opens path on every exporter and returns a single stream writing to all of them """
+    with contextlib.ExitStack() as stack:
+        streams = [stack.enter_context(exporter.open_stream(path)) for exporter in exporters]
+        with TeeStream(streams) as stream:
+            yield stream
+
+
+__all__ = [
+    "S3MultipartStream",
+    "TeeStream",
+    "open_streams"
+]
@@ -1,9 +1,6 @@
-from environs import env
-env.read_env()
-
 import argparse
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 from s3 import *
 from annotations import *
@@ -11,6 +8,22 @@ from exporter import *
 from builder import *
 
 
+def read_s3_config() -> Tuple[S3ConnectionConfig, S3Credentials]:
+    from environs import env
+    env.read_env()
+
+    s3_connection = S3ConnectionConfig(
+        region=env('AWS_REGION_NAME'),
+        endpoint=env('AWS_ENDPOINT_URL')
+    )
+    s3_credentials = S3Credentials(
+        access_key_id=env('AWS_ACCESS_KEY_ID'),
+        secret_access_key=env('AWS_SECRET_ACCESS_KEY'),
+        session_token=env('AWS_SESSION_TOKEN')
+    )
+    return s3_connection, s3_credentials
+
+
 def main():
     # 0. Create parser
     parser = argparse.ArgumentParser(
@@ -20,26 +33,27 @@ def main():
     parser.add_argument("--from", nargs=2, metavar=("TYPE", "VALUE"), action='append')
     parser.add_argument('--to', nargs=2, metavar=("TYPE", "VALUE"), action='append')
     parser.add_argument('--data', choices=['trocr'], default='trocr')
+    parser.add_argument('--s3-workers', type=int, default=16, metavar='COUNT')
+    parser.add_argument('--s3-checkpoint', type=Path, metavar='DIR',
+                        help='Resume interrupted S3 loads, later loads only download annotations whose ETag changed')
+    parser.add_argument('--crop-height', type=int, metavar='HEIGHT')
+    parser.add_argument('--crop-size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--grayscale', action='store_true')
+    parser.add_argument('--image-format', choices=['jpg', 'png', 'webp'], default='jpg')
+    parser.add_argument('--image-quality', type=int, metavar='QUALITY')
     args = parser.parse_args()
 
-    # 1. Connect to S3
-    s3_connection = S3ConnectionConfig(
-        region=env('AWS_REGION_NAME'),
-        endpoint=env('AWS_ENDPOINT_URL')
-    )
-    s3_credentials = S3Credentials(
-        access_key_id=env('AWS_ACCESS_KEY_ID'),
-        secret_access_key=env('AWS_SECRET_ACCESS_KEY'),
-        session_token=env('AWS_SESSION_TOKEN')
-    )
-    s3_context = S3Context(s3_connection, s3_credentials)
+    # 1. Prepare S3, it's only connected to if something actually uses it
+    # S3 loader runs listing and download threads on one client, both up to --s3-workers
+    s3_context = S3Context.lazy(read_s3_config, max_pool_connections=2 * args.s3_workers)
 
     # 2. Get task annotations
     tasks: List[Task] = []
     for loader in (_from := getattr(args, 'from')):
         match loader:
             case ['s3', s3_url]:
-                loader_tasks = S3AnnotationLoader(s3_context).get_tasks(s3_url)
+                s3_loader = S3AnnotationLoader(s3_context, args.s3_workers, args.s3_checkpoint)
+                loader_tasks = s3_loader.get_tasks(s3_url)
             case ['export', json_filepath]:
                 loader_tasks = ExportAnnotationLoader().get_tasks(json_filepath)
             case _:
@@ -61,7 +75,14 @@ def main():
     # 4. Pick an dataset builder and build
     match args.data:
         case 'trocr':
-            builder = TrOCRBuilder(s3_context)
+            crop_config = CropConfig(
+                height=args.crop_height,
+                size=tuple(args.crop_size) if args.crop_size else None,
+                grayscale=args.grayscale,
+                format=args.image_format,
+                quality=args.image_quality
+            )
+            builder = TrOCRBuilder(s3_context, crop_config)
         case _:
             raise ValueError(f'Unknown dataset type {args.data}')
     
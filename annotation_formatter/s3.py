@@ -1,9 +1,8 @@
 import io
 import re
 import dataclasses
-from typing import Union
-
-import boto3
+from functools import cached_property
+from typing import Callable, Tuple, Union
 
 
 S3_URL_PATTERN = re.compile("^s3://(?P<bucket>[^/\s]+)(?:/(?P<prefix>[^\s]*?(?P<item>[^/\s]+)/?)?)?$")
@@ -23,16 +22,48 @@ class S3Credentials:
 
 
 class S3Context:
-    def __init__(self, connection: S3ConnectionConfig, credentials: S3Credentials):        
-        self.session = boto3.session.Session(    
-            aws_access_key_id=credentials.access_key_id,
-            aws_secret_access_key=credentials.secret_access_key,
-            aws_session_token=credentials.session_token
+    """ boto3 is imported and connected only when S3 is first used
+
+        max_pool_connections should be at least the number of threads sharing the
+        client, botocore keeps 10 connections by default and drops the rest
+    """
+    def __init__(self, connection: S3ConnectionConfig, credentials: S3Credentials, max_pool_connections: int = 10):
+        self.connection = connection
+        self.credentials = credentials
+        self.max_pool_connections = max_pool_connections
+        self._config_loader = None
+
+    @classmethod
+    def lazy(cls, config_loader: Callable[[], Tuple[S3ConnectionConfig, S3Credentials]],
+             max_pool_connections: int = 10) -> "S3Context":
+        """ Context that reads its config only when S3 is first used """
+        context = cls(None, None, max_pool_connections)
+        context._config_loader = config_loader
+        return context
+
+    @cached_property
+    def session(self):
+        import boto3
+
+        if self._config_loader is not None:
+            self.connection, self.credentials = self._config_loader()
+
+        return boto3.session.Session(
+            aws_access_key_id=self.credentials.access_key_id,
+            aws_secret_access_key=self.credentials.secret_access_key,
+            aws_session_token=self.credentials.session_token
         )
-        self.resource = self.session.resource(
+
+    @cached_property
+    def resource(self):
+        from botocore.config import Config
+
+        session = self.session
+        return session.resource(
             service_name='s3',
-            region_name=connection.region,
-            endpoint_url=connection.endpoint
+            region_name=self.connection.region,
+            endpoint_url=self.connection.endpoint,
+            config=Config(max_pool_connections=self.max_pool_connections)
         )
     
     def download_bytes(self, object) -> bytes:
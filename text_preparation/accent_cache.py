@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from importlib import metadata
+from collections import OrderedDict
+
+
+# SQLite limits amount of parameters in a single query
+QUERY_BATCH_SIZE = 500
+
+
+def get_accentor_version() -> str:
+    """ Version of installed russian_g2p, with commit hash for git installs """
+    try:
+        distribution = metadata.distribution('russian_g2p')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+    version = distribution.version
+    try:
+        direct_url = json.loads(distribution.read_text('direct_url.json') or '{}')
+        if commit := direct_url.get('vcs_info', {}).get('commit_id'):
+            version += f'+{commit}'
+    except json.JSONDecodeError:
+        pass
+    return version
+
+
+class AccentCache:
+    """ Word -> accented word memo, in-memory LRU in front of an SQLite file
+
+        Entries are keyed by Accentor version, so upgrading russian_g2p
+        doesn't return accents made by the previous model
+    """
+    def __init__(self, path: Path | None, version: str, memory_size: int = 100_000):
+        self.path = path
+        self.version = version
+        self.memory_size = memory_size
+
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def get_many(self, words: list[str]) -> dict[str, str]:
+        """ Returns accents of cached words, missing words are left out """
+        found = {}
+        with self._lock:
+            missing = []
+            for word in words:
+                if (accented := self._memory.get(word)) is not None:
+                    self._memory.move_to_end(word)
+                    found[word] = accented
+                else:
+                    missing.append(word)
+
+            if missing and (connection := self._connect()) is not None:
+                for i in range(0, len(missing), QUERY_BATCH_SIZE):
+                    batch = missing[i:i+QUERY_BATCH_SIZE]
+                    rows = connection.execute(
+                        f'SELECT word, accented FROM accents WHERE version = ? AND word IN ({",".join("?" * len(batch))})',
+                        [self.version, *batch]
+                    )
+                    for word, accented in rows:
+                        found[word] = accented
+                        self._remember(word, accented)
+        return found
+
+    def put_many(self, accents: dict[str, str]):
+        with self._lock:
+            for word, accented in accents.items():
+                self._remember(word, accented)
+
+            if accents and (connection := self._connect()) is not None:
+                with connection:
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO accents (version, word, accented) VALUES (?, ?, ?)',
+                        [(self.version, word, accented) for word, accented in accents.items()]
+                    )
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _remember(self, word: str, accented: str):
+        self._memory[word] = accented
+        self._memory.move_to_end(word)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection | None:
+        """ Opens the database on first use, memory-only cache if there's no path """
+        if self.path is None:
+            return None
+
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS accents ('
+                'version TEXT NOT NULL, word TEXT NOT NULL, accented TEXT NOT NULL, '
+                'PRIMARY KEY (version, word)) WITHOUT ROWID'
+            )
+        return self._connection
@@ -0,0 +1,145 @@
+import time
+import zlib
+import random
+import argparse
+import tracemalloc
+from typing import Callable
+
+import to_phonetic
+from accent_cache import AccentCache
+from to_phonetic import (
+    VOWELS, CONSONANTS,
+    decompose_acutes, add_accents, add_softness, add_yots, add_pauses,
+    apply_phonetic_rules, to_phonetic_transcription
+)
+
+
+class FakeAccentor:
+    """ Deterministic stand-in for russian_g2p Accentor, stresses one vowel picked by word hash """
+    def do_accents(self, source_phrase: list[list[str]]) -> list[list[str]]:
+        return [[self.accent(variants[0]) for variants in source_phrase]]
+
+    @staticmethod
+    def accent(word: str) -> str:
+        vowels = [i for i, char in enumerate(word) if char in VOWELS]
+        if not vowels:
+            return word
+        i = vowels[zlib.crc32(word.encode('utf-8')) % len(vowels)]
+        return word[:i+1] + '+' + word[i+1:]
+
+
+def generate_vocabulary(size: int, rng: random.Random) -> list[str]:
+    consonants = ''.join(sorted(set(CONSONANTS.lower()))) + 'ь'
+    vowels = ''.join(sorted(set(VOWELS.lower())))
+
+    words = set()
+    while len(words) < size:
+        syllables = rng.randint(1, 4)
+        word = ''
+        for _ in range(syllables):
+            # some syllables start with a vowel to get yots
+            if rng.random() < 0.8:
+                word += rng.choice(consonants)
+            word += rng.choice(vowels)
+        if rng.random() < 0.3:
+            word += rng.choice(consonants)
+        words.add(word)
+    return sorted(words)
+
+
+def generate_text(size: int, vocabulary: list[str], rng: random.Random) -> str:
+    """ Russian-looking text of about size characters made of sentences with commas """
+    parts = []
+    length = 0
+    while length < size:
+        sentence = [rng.choice(vocabulary) for _ in range(rng.randint(3, 15))]
+        sentence[0] = sentence[0].capitalize()
+        for i in range(len(sentence) - 1):
+            if rng.random() < 0.15:
+                sentence[i] += ','
+        sentence = ' '.join(sentence) + rng.choice(['.', '.', '.', '!', '?', '?!', '...'])
+        sentence += '\n' if rng.random() < 0.1 else ' '
+
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)[:size]
+
+
+def reset_accent_cache():
+    """ Every run starts with an empty memory-only cache, so the disk cache isn't touched """
+    to_phonetic.accent_cache = AccentCache(None, 'benchmark')
+
+
+def measure(function: Callable[[str], str], text: str, repeat: int) -> tuple[float, int, str]:
+    """ Returns best time of repeat runs, peak memory of a separate traced run and the result """
+    best = float('inf')
+    for _ in range(repeat):
+        reset_accent_cache()
+        start = time.perf_counter()
+        result = function(text)
+        best = min(best, time.perf_counter() - start)
+
+    reset_accent_cache()
+    tracemalloc.start()
+    function(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='benchmark',
+        description='Measures speed and memory of every transcription stage'
+    )
+    parser.add_argument('--size', type=int, default=1_000_000, help='Characters of generated text')
+    parser.add_argument('--vocabulary', type=int, default=20_000, help='Unique words in generated text')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, best one is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real-accentor', action='store_true', help='Use russian_g2p Accentor instead of a stub')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    text = generate_text(args.size, generate_vocabulary(args.vocabulary, rng), rng)
+
+    if args.real_accentor:
+        accentor_start = time.perf_counter()
+        to_phonetic.get_accentor()
+        print(f'Accentor loaded in {time.perf_counter() - accentor_start:.2f}s')
+    else:
+        to_phonetic.set_accentor(FakeAccentor())
+
+    print(f'{len(text)} characters, {args.vocabulary} words in vocabulary')
+    print(f'{"stage":<28}{"chars/s":>14}{"seconds":>10}{"peak MiB":>10}')
+
+    # Stages are chained, each one gets the output of the previous one like in the pipeline
+    stages = [
+        ('decompose_acutes', decompose_acutes),
+        ('add_accents', add_accents),
+        ('add_softness', add_softness),
+        ('add_yots', add_yots),
+        ('add_pauses', add_pauses),
+    ]
+    stage_input = text
+    for name, stage in stages:
+        seconds, peak, stage_input = measure(stage, stage_input, args.repeat)
+        print(f'{name:<28}{len(text) / seconds:>14,.0f}{seconds:>10.3f}{peak / 2**20:>10.1f}')
+    reference = ' '.join(stage_input.split())
+
+    accented = add_accents(text)
+    for name, function, function_input in [
+        ('apply_phonetic_rules', apply_phonetic_rules, accented),
+        ('to_phonetic_transcription', to_phonetic_transcription, text),
+    ]:
+        seconds, peak, result = measure(function, function_input, args.repeat)
+        print(f'{name:<28}{len(text) / seconds:>14,.0f}{seconds:>10.3f}{peak / 2**20:>10.1f}')
+
+    # The fused engine has to match the staged pipeline exactly
+    if result != reference:
+        raise SystemExit('to_phonetic_transcription output differs from the staged pipeline')
+    print('Fused output matches staged pipeline')
+
+
+if __name__ == "__main__":
+    main()
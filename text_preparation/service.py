@@ -0,0 +1,126 @@
+import time
+import queue
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import Future, TimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from to_phonetic import get_accentor, accent_words, decompose_acutes, get_words, to_phonetic_transcription
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+class AccentBatcher:
+    """ Merges words of requests that come within a short window into a single accent_words call """
+    def __init__(self, window: float = 0.01, timeout: float = 60):
+        self.window = window
+        self.timeout = timeout
+        self._queue: queue.Queue[tuple[set[str], Future]] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def accent(self, words: set[str]) -> dict[str, str]:
+        future = Future()
+        self._queue.put((words, future))
+        return future.result(timeout=self.timeout)
+
+    def _run(self):
+        while True:
+            # wait for the first request, then collect everything that comes within the window
+            requests = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    requests.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # the thread serves every request, so nothing from a batch may escape it
+            try:
+                words = set().union(*(request_words for request_words, _ in requests))
+                accents = accent_words(sorted(words))
+                results = [{word: accents[word] for word in request_words} for request_words, _ in requests]
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(requests, results):
+                future.set_result(result)
+
+
+class TranscriptionHandler(BaseHTTPRequestHandler):
+    """ POST /transcribe with utf-8 text in body, responds with its transcription """
+    def do_POST(self):
+        if self.path != '/transcribe':
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        text = self.rfile.read(length).decode('utf-8')
+
+        try:
+            accents = self.server.batcher.accent(get_words(decompose_acutes(text)))
+            transcription = to_phonetic_transcription(text, accents)
+        except TimeoutError:
+            self.send_error(504, explain='Accenting took too long')
+            return
+        except Exception as e:
+            self.send_error(500, explain=repr(e))
+            return
+
+        body = transcription.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def transcribe(text: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> str:
+    """ Transcribes text using a running service """
+    request = urllib.request.Request(
+        f'http://{host}:{port}/transcribe',
+        data=text.encode('utf-8'),
+        headers={'Content-Type': 'text/plain; charset=utf-8'},
+        method='POST'
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='service',
+        description='Keeps Accentor loaded and serves transcriptions over localhost HTTP'
+    )
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--window', type=float, default=0.01, help='Seconds to wait for requests to batch together')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds a request waits for its accents')
+    args = parser.parse_args()
+
+    # Load the model before accepting requests
+    get_accentor()
+
+    batcher = AccentBatcher(args.window, args.timeout)
+    batcher.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), TranscriptionHandler)
+    server.batcher = batcher
+    print(f'Serving transcriptions on http://{args.host}:{args.port}/transcribe')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
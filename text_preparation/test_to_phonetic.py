@@ -0,0 +1,162 @@
+import io
+import random
+
+import pytest
+
+import to_phonetic
+from to_phonetic import (
+    RUSSIAN_ALPHABET, COMBINING_ACUTE, MAX_CHUNK_FACTOR,
+    add_softness, add_yots, add_pauses,
+    apply_phonetic_rules, to_phonetic_transcription,
+    iter_sentence_chunks, transcribe_stream
+)
+
+
+class IdentityAccentor:
+    """ Leaves words as they are, so only the phonetic rules are tested """
+    def do_accents(self, source_phrase):
+        return [[variants[0] for variants in source_phrase]]
+
+
+class FirstVowelAccentor:
+    """ Stresses the first vowel of every word """
+    def do_accents(self, source_phrase):
+        result = []
+        for variants in source_phrase:
+            word = variants[0]
+            i = next((i for i, char in enumerate(word) if char in to_phonetic.VOWELS), None)
+            result.append(word if i is None else word[:i+1] + '+' + word[i+1:])
+        return [result]
+
+
+@pytest.fixture(autouse=True)
+def stub_accentor():
+    accentor, accent_cache = to_phonetic._accentor, to_phonetic.accent_cache
+    to_phonetic.set_accentor(IdentityAccentor())
+    yield
+    to_phonetic._accentor, to_phonetic.accent_cache = accentor, accent_cache
+
+
+def staged_rules(text: str) -> str:
+    """ The pipeline apply_phonetic_rules replaces, stage by stage """
+    text = add_softness(text)
+    text = add_yots(text)
+    text = add_pauses(text)
+    return ' '.join(text.split())
+
+
+GOLDEN = [
+    # sentence ends and empty sentences
+    ('Привет. Как дела?', "Пр'ив'ет // Как д'ела //"),
+    ('Да?! Нет... Ну!', "Да // Н'ет // Ну //"),
+    ('Раз.. Два', 'Раз // Два'),
+    ('...начало', '// Начало'),
+    ('конец!!!', "Кон'ец //"),
+    ('. . .', '// // //'),
+    # commas
+    ('Мама, папа, я.', 'Мама / папа / я //'),
+    ('a,,b', 'A / / b'),
+    (',', '/'),
+    ('а, я', 'А / я'),
+    ('н,я', 'Н / я'),
+    # soft vowel after a consonant or a vowel, whitespace and punctuation break both rules
+    ('мя', "М'я"),
+    ('ая', 'Аjа'),
+    ('а я', 'А я'),
+    ('н я', 'Н я'),
+    ('а.я', 'А // Я'),
+    ('моё́ е́ль', 'Моjо́ е́ль'),
+    ('Моя мама мыла раму, а я ела яблоко.', 'Моjа мама мыла раму / а я ела яблоко //'),
+    # capitalization
+    ('МЯ', "М'я"),
+    ('АЯ Ёлка', 'Аjа ёлка'),
+    ('привет МИР', "Пр'ив'ет м'ир"),
+    ('сЛОВО. вТОРОЕ', 'Слово // Второjе'),
+    ('é', 'É'),
+    ('e' + COMBINING_ACUTE, 'E' + COMBINING_ACUTE),
+    # whitespace
+    ('  пробелы \n\t и   переносы  ', "Проб'елы и п'ер'еносы"),
+]
+
+
+@pytest.mark.parametrize('text, expected', GOLDEN)
+def test_golden_output(text, expected):
+    assert apply_phonetic_rules(text) == expected
+    assert staged_rules(text) == expected
+    assert to_phonetic_transcription(text) == expected
+
+
+def test_empty_text():
+    assert apply_phonetic_rules('') == ''
+    assert to_phonetic_transcription('') == ''
+
+
+def test_accents_are_spliced_by_whole_words():
+    to_phonetic.set_accentor(FirstVowelAccentor())
+
+    text = 'Моя мама, а я ела. Моло' + COMBINING_ACUTE + 'ко мама-то!'
+    assert to_phonetic_transcription(text) == (
+        'Мо́я ма́ма / а́ я́ е́ла // Моло́ко ма́ма-то //'
+    )
+
+    # precomposed characters with acute are kept as they were
+    assert to_phonetic_transcription('кафé, мама') == 'Кафé / ма́ма'
+
+
+def test_fused_rules_match_staged_pipeline():
+    rng = random.Random(0)
+    alphabet = RUSSIAN_ALPHABET + 'abcXYZ' + ' \n\t,.,!?-' + COMBINING_ACUTE + 'éÁ' + 'ßΣ\xa0ǆ'
+
+    for _ in range(20000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 40)))
+        assert apply_phonetic_rules(text) == staged_rules(text), repr(text)
+
+
+def transcribe_in_chunks(text: str, chunk_size: int, max_chunk_size: int | None = None) -> str:
+    output = io.StringIO()
+    transcribe_stream(io.StringIO(text), output, chunk_size, max_chunk_size=max_chunk_size)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('text, expected', GOLDEN)
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7])
+def test_streaming_golden_output(text, expected, chunk_size):
+    assert transcribe_in_chunks(text, chunk_size, max_chunk_size=1000) == expected
+
+
+def test_streaming_matches_whole_text():
+    rng = random.Random(1)
+    alphabet = RUSSIAN_ALPHABET + 'ab' + '   \n,.!?' + COMBINING_ACUTE
+
+    for _ in range(5000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        whole = to_phonetic_transcription(text)
+        for chunk_size in (1, 3, 7, 50):
+            assert transcribe_in_chunks(text, chunk_size, max_chunk_size=1000) == whole, (repr(text), chunk_size)
+
+
+def test_streaming_cut_at_whitespace_matches_whole_text():
+    rng = random.Random(3)
+    words = ['мама', 'ЯБЛОКО', 'ель', 'Σίσυφος', 'моё́', 'и', 'а', ',', '.', '?!', '...']
+    separators = [' ', '  ', '\n', ', ', '\xa0']
+
+    for _ in range(2000):
+        text = ''.join(rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(0, 30)))
+        whole = to_phonetic_transcription(text)
+        for chunk_size in (1, 2, 3, 5):
+            assert transcribe_in_chunks(text, chunk_size, max_chunk_size=10) == whole, (repr(text), chunk_size)
+
+
+def test_streaming_text_without_sentence_ends_is_cut_at_whitespace():
+    rng = random.Random(2)
+    words = ['мама', 'ЯБЛОКО', 'ель,', 'Σίσυφος', 'моё', ',', 'и']
+    text = ' '.join(rng.choice(words) for _ in range(2000))
+
+    chunks = list(iter_sentence_chunks(io.StringIO(text), 16))
+    assert max(len(chunk) for chunk, _ in chunks) <= 16 * MAX_CHUNK_FACTOR + 16
+    assert transcribe_in_chunks(text, 16) == to_phonetic_transcription(text)
+
+
+def test_streaming_fails_without_sentence_ends_or_whitespace():
+    with pytest.raises(ValueError):
+        transcribe_in_chunks('а' * 100, 4, max_chunk_size=16)
@@ -1,9 +1,16 @@
+import os
 import re
+import json
+import argparse
 import unicodedata
 from string import *
 from pathlib import Path
+from itertools import accumulate
+from typing import Iterator, TextIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from russian_g2p.Accentor import Accentor
+from utils import get_file_md5
+from accent_cache import AccentCache, get_accentor_version
 
 
 # Useful constants
@@ -21,19 +28,67 @@ RUSSIAN_ALPHABET = CONSONANTS + VOWELS + 'ьъЬЪ'
 COMBINING_ACUTE = '\u0301'
 APOSTROPHE = '\u0027'
 
+YOT_TABLE = {
+    'я': 'jа',
+    'ё': 'jо',
+    'ю': 'jу',
+    'и': 'jи',
+    'е': 'jе',
+}
 
-accentor = Accentor()
+SENTENCE_ENDS = '?!.'
+
+# Words are runs of these symbols, acute is kept so already accented words stay intact
+WORD_ALPHABET = RUSSIAN_ALPHABET + ascii_letters + digits + '-'
+WORD_PATTERN = re.compile(f'[{re.escape(WORD_ALPHABET)}{COMBINING_ACUTE}]+')
+
+ACCENT_CACHE_PATH = Path('.').absolute() / 'accent_cache.sqlite3'
+
+# Bump when transcription rules change, so outputs made by older rules get redone
+PIPELINE_VERSION = '1'
+
+# Characters read at once when transcribing in a streaming way
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Text without sentence ends is cut at whitespace once it's this many chunks long
+MAX_CHUNK_FACTOR = 4
+
+
+_accentor = None
+accent_cache = AccentCache(ACCENT_CACHE_PATH, get_accentor_version())
+
+
+def get_accentor():
+    """ Accentor takes seconds to load its model, so it's created on first use """
+    global _accentor
+    if _accentor is None:
+        from russian_g2p.Accentor import Accentor
+        _accentor = Accentor()
+    return _accentor
+
+
+def set_accentor(accentor):
+    """ Replaces Accentor with anything that has the same do_accents, e.g. a stub for benchmarks
+        Its accents go to a separate memory-only cache, so they never end up in the disk cache
+    """
+    global _accentor, accent_cache
+    _accentor = accentor
+    accent_cache = AccentCache(None, f'{type(accentor).__module__}.{type(accentor).__qualname__}')
+
+
+class _AcuteDecomposition(dict):
+    """ str.translate table that decomposes characters with acute, filled on first sight """
+    def __missing__(self, code: int) -> str:
+        char = chr(code)
+        decomposed = unicodedata.normalize('NFD', char)
+        self[code] = result = decomposed if COMBINING_ACUTE in decomposed else char
+        return result
+
+
+ACUTE_DECOMPOSITION = _AcuteDecomposition()
 
 
 def decompose_acutes(text: str) -> str:
-    result = ""
-    for char in text:
-        decomposed = unicodedata.normalize('NFD', char) 
-        if COMBINING_ACUTE in decomposed:
-            result += decomposed
-        else:
-            result += char 
-    return result
+    return text.translate(ACUTE_DECOMPOSITION)
 
 
 # def add_accents(text: str) -> str:
@@ -53,25 +108,64 @@ def decompose_acutes(text: str) -> str:
 #     return ' '.join(result)
 
 
-def add_accents(text: str) -> str:
-    normalized = decompose_acutes(text)
+def accent_words(words: list[str]) -> dict[str, str]:
+    """ Returns accented form of every word, only words missing in cache go to Accentor """
+    accents = accent_cache.get_many(words)
 
-    # Filter all non-word symbols
-    words = set()
-    alphabet = RUSSIAN_ALPHABET + ascii_letters + digits + '-'
-    for word in normalized.split():
-        word = ''.join(filter(lambda c: c in alphabet, word))
-        if word:
-            words.add(word)
-    words = list(words)
+    missing = [word for word in words if word not in accents]
+    if missing:
+        new_accents = dict(zip(missing, do_accents(missing)))
+        accent_cache.put_many(new_accents)
+        accents.update(new_accents)
+    return accents
 
+
+def do_accents(words: list[str]) -> list[str]:
+    """ Accents words with Accentor directly, bypassing the cache """
     to_accent = [[word] for word in words]
-    accent_data = accentor.do_accents(to_accent)
-    accented = [word.replace('+', COMBINING_ACUTE) for word in accent_data[0]]
+    accent_data = get_accentor().do_accents(to_accent)
+    if len(accent_data[0]) != len(words):
+        raise ValueError(f'Accentor returned {len(accent_data[0])} words for {len(words)}')
+    return [word.replace('+', COMBINING_ACUTE) for word in accent_data[0]]
+
 
-    for word, accented_word in zip(words, accented):
-        text = text.replace(word, accented_word)
-    return text
+def get_words(normalized: str) -> set[str]:
+    """ Unique words of decomposed text that aren't accented yet """
+    return {word for word in WORD_PATTERN.findall(normalized) if COMBINING_ACUTE not in word}
+
+
+def add_accents(text: str, accents: dict[str, str] | None = None) -> str:
+    """ Accents every word of text, words are looked up in accents if they're given """
+    normalized = decompose_acutes(text)
+
+    if accents is None:
+        accents = accent_words(list(get_words(normalized)))
+
+    def accent(match: re.Match) -> str:
+        return accents.get(match[0], match[0])
+
+    # Splice accented words in one pass, only whole words are replaced
+    if len(normalized) == len(text):
+        return WORD_PATTERN.sub(accent, text)
+
+    # Text has characters with acute, words are found in normalized text but spliced into
+    # the original one, so those characters are kept as they were. Words without acute
+    # are the same in both, they only have to be mapped to positions in text. Words that
+    # start or end inside such a character are left as they are
+    offsets = accumulate((len(ACUTE_DECOMPOSITION[ord(char)]) for char in text), initial=0)
+    positions = {offset: position for position, offset in enumerate(offsets)}
+
+    parts = []
+    end = 0
+    for match in WORD_PATTERN.finditer(normalized):
+        start, stop = positions.get(match.start()), positions.get(match.end())
+        if start is None or stop is None or COMBINING_ACUTE in match[0]:
+            continue
+        parts.append(text[end:start])
+        parts.append(accent(match))
+        end = stop
+    parts.append(text[end:])
+    return ''.join(parts)
 
 
 def add_softness(text: str) -> str:
@@ -100,13 +194,7 @@ def add_pauses(text: str) -> str:
     
 
 def add_yots(text: str) -> str:
-    yot_table = {
-        'я': 'jа',
-        'ё': 'jо',
-        'ю': 'jу',
-        'и': 'jи',
-        'е': 'jе',
-    }
+    yot_table = YOT_TABLE
 
     result = text[0]
     for i in range(1, len(text)):
@@ -119,25 +207,312 @@ def add_yots(text: str) -> str:
     return result
 
 
-def to_phonetic_transcription(text: str) -> str:
-    text = add_accents(text)
-    text = add_softness(text)
-    text = add_yots(text)
-    text = add_pauses(text)
+# Character classes for apply_phonetic_rules
+_SOFT_VOWELS = frozenset(SOFT_VOWELS)
+_VOWELS = frozenset(VOWELS)
+_PAIRED_CONSONANTS = frozenset(PAIRED_CONSONANTS)
+_SENTENCE_ENDS = frozenset(SENTENCE_ENDS)
 
-    text = ' '.join(text.split())
-    return text
+
+def apply_phonetic_rules(text: str, continues_sentence: bool = False) -> str:
+    """ add_softness, add_yots, add_pauses and whitespace cleanup fused into a single pass,
+        output is identical to applying them one after another
+
+        continues_sentence means text is the rest of a sentence started in a previous
+        piece of text, so its first sentence isn't capitalized again
+    """
+    sentences = []   # finished sentences
+    tokens = []      # words and short pauses of current sentence
+    word = []        # symbols of current word
+
+    previous = None
+    for char in text:
+        if char in _SENTENCE_ENDS:
+            # a run of sentence ends is a single long pause
+            if previous not in _SENTENCE_ENDS:
+                if word:
+                    tokens.append(''.join(word))
+                    word = []
+                sentences.append(' '.join(tokens))
+                tokens = []
+        elif char == ',':
+            if word:
+                tokens.append(''.join(word))
+                word = []
+            tokens.append('/')
+        elif char.isspace():
+            if word:
+                tokens.append(''.join(word))
+                word = []
+        elif char in _SOFT_VOWELS and previous in _PAIRED_CONSONANTS:
+            word.append(APOSTROPHE)
+            word.append(char)
+        elif char in _SOFT_VOWELS and previous in _VOWELS:
+            word.append(YOT_TABLE[char.lower()])
+        else:
+            word.append(char)
+        previous = char
+
+    if word:
+        tokens.append(''.join(word))
+    sentences.append(' '.join(tokens))
+
+    # rest of a sentence is lowercased the same way capitalize does it
+    sentences = [
+        sentence.lower() if i == 0 and continues_sentence else sentence.capitalize()
+        for i, sentence in enumerate(sentences)
+    ]
+
+    # empty sentences leave only their long pause
+    parts = [sentences[0]] if sentences[0] else []
+    for sentence in sentences[1:]:
+        parts.append('//')
+        if sentence:
+            parts.append(sentence)
+    return ' '.join(parts)
+
+
+def to_phonetic_transcription(text: str, accents: dict[str, str] | None = None, continues_sentence: bool = False) -> str:
+    text = add_accents(text, accents)
+    return apply_phonetic_rules(text, continues_sentence)
+
+
+def _trailing_sentence_ends(text: str) -> int:
+    """ Start of the run of sentence ends text finishes with, it may continue in the next piece of text """
+    end = len(text)
+    while end and text[end-1] in SENTENCE_ENDS:
+        end -= 1
+    return end
+
+
+def _last_sentence_boundary(text: str) -> int:
+    """ Position right after the last complete run of sentence ends, 0 if there's none """
+    end = _trailing_sentence_ends(text)
+    position = max(text.rfind(char, 0, end) for char in SENTENCE_ENDS)
+    return position + 1
+
+
+def _last_whitespace(text: str) -> int:
+    """ Position of the last whitespace before trailing sentence ends, 0 if there's none """
+    for position in range(_trailing_sentence_ends(text) - 1, 0, -1):
+        if text[position].isspace():
+            return position
+    return 0
+
+
+def iter_sentence_chunks(file: TextIO, chunk_size: int, max_chunk_size: int | None = None) -> Iterator[tuple[str, bool]]:
+    """ Reads file in chunks of about chunk_size characters, yields (chunk, ends_sentence)
+
+        Chunks are cut right after sentences the same way add_pauses splits them. Text
+        without sentence ends is cut at whitespace once it grows past max_chunk_size,
+        such chunks end mid-sentence. Every chunk can be transcribed on its own
+    """
+    max_chunk_size = max_chunk_size or chunk_size * MAX_CHUNK_FACTOR
+
+    buffer = ''
+    while piece := file.read(chunk_size):
+        buffer += piece
+        if boundary := _last_sentence_boundary(buffer):
+            yield buffer[:boundary], True
+            buffer = buffer[boundary:]
+        elif len(buffer) >= max_chunk_size:
+            if not (boundary := _last_whitespace(buffer)):
+                raise ValueError(f'No sentence end or whitespace in {len(buffer)} characters, can\'t split text into chunks')
+            yield buffer[:boundary], False
+            buffer = buffer[boundary:]
+
+    if buffer:
+        yield buffer, True
+
+
+def transcribe_stream(file: TextIO, output_file: TextIO, chunk_size: int, accents: dict[str, str] | None = None,
+                      max_chunk_size: int | None = None):
+    """ Transcribes file chunk by chunk, output is identical to transcribing it as a whole """
+    written = False
+    in_sentence = False
+    for chunk, ends_sentence in iter_sentence_chunks(file, chunk_size, max_chunk_size):
+        # chunks end with a long pause or between words, so they're joined just like words are
+        if transcription := to_phonetic_transcription(chunk, accents, in_sentence):
+            if written:
+                output_file.write(' ')
+            output_file.write(transcription)
+            written = True
+
+        # sentence cut at whitespace continues in the next chunk if it already has words or pauses
+        in_sentence = not ends_sentence and (in_sentence or bool(transcription))
+
+
+def transcribe_file(input_path: Path, output_path: Path, chunk_size: int | None = None, accents: dict[str, str] | None = None):
+    """ Transcribes a whole file at once, or in a streaming way if chunk_size is given
+        Output is written next to output_path and replaces it only when transcription succeeds
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = output_path.with_name(output_path.name + '.part')
+    try:
+        with open(input_path, 'r', encoding='utf-8') as file:
+            with open(partial_path, 'w', encoding='utf-8') as output_file:
+                if chunk_size is None:
+                    output_file.write(to_phonetic_transcription(file.read(), accents))
+                else:
+                    transcribe_stream(file, output_file, chunk_size, accents)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+    partial_path.replace(output_path)
+
+
+# Accents known to a transcription worker process
+_worker_accents: dict[str, str] = {}
+
+
+def _init_transcription_worker(accents: dict[str, str]):
+    global _worker_accents
+    _worker_accents = accents
+
+
+def _transcribe_file(input_path: Path, output_path: Path, chunk_size: int | None):
+    transcribe_file(input_path, output_path, chunk_size, _worker_accents)
+
+
+def transcribe_corpus(filenames: list[Path], texts: Path, output: Path, workers: int, batch_size: int,
+                      chunk_size: int | None = None) -> Iterator[Path]:
+    """ Accents the vocabulary of all files at once, then transcribes files in parallel
+        Outputs mirror paths of files in texts folder under output folder
+
+        Yields every file as soon as its output is written. Files that fail don't stop
+        the rest, the first error is raised once all files are done
+    """
+    # 1. Collect unique words across the corpus
+    vocabulary = set()
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as file:
+            if chunk_size is None:
+                vocabulary |= get_words(decompose_acutes(file.read()))
+            else:
+                for chunk, _ in iter_sentence_chunks(file, chunk_size):
+                    vocabulary |= get_words(decompose_acutes(chunk))
+    vocabulary = sorted(vocabulary)
+
+    # 2. Accent words missing in cache in large batches, one Accentor per worker process
+    accents = accent_cache.get_many(vocabulary)
+    missing = [word for word in vocabulary if word not in accents]
+    print(f'{len(vocabulary)} unique words, {len(missing)} not cached')
+
+    if missing:
+        batches = [missing[i:i+batch_size] for i in range(0, len(missing), batch_size)]
+        with ProcessPoolExecutor(workers) as executor:
+            for batch, accented in zip(batches, executor.map(do_accents, batches)):
+                new_accents = dict(zip(batch, accented))
+                accent_cache.put_many(new_accents)
+                accents.update(new_accents)
+
+    # 3. Run the cheap per-file passes in parallel
+    with ProcessPoolExecutor(workers, initializer=_init_transcription_worker, initargs=(accents,)) as executor:
+        futures = {
+            executor.submit(_transcribe_file, filename, output / filename.relative_to(texts), chunk_size): filename
+            for filename in filenames
+        }
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f'Failed to transcribe {futures[future]}:', repr(e))
+                error = error or e
+            else:
+                yield futures[future]
+
+    if error is not None:
+        raise error
+
+
+def get_pipeline_version() -> str:
+    return f'{PIPELINE_VERSION}/{accent_cache.version}'
+
+
+def load_manifest(path: Path) -> dict[str, dict]:
+    """ Input path relative to texts folder -> input md5 and pipeline version its output was made with """
+    if not path.exists():
+        return {}
+
+    try:
+        with open(path, mode='r', encoding='utf-8') as file:
+            return json.load(file)
+    except Exception as e:
+        print("Failed to load manifest:", repr(e))
+        return {}
+
+
+def save_manifest(path: Path, manifest: dict[str, dict]):
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, mode='w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    temp_path.replace(path)
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        prog='to_phonetic',
+        description='Transcribes texts from texts folder into output folder'
+    )
+    parser.add_argument('--batch', action='store_true', help='Accent whole corpus at once using several processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Process count for batch mode')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Words per Accentor call in batch mode')
+    parser.add_argument('--stream', action='store_true', help='Transcribe and write files chunk by chunk')
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help='Characters per chunk in stream mode')
+    parser.add_argument('--process-all', action='store_true', help='Transcribe files even if their output is up to date')
+    args = parser.parse_args()
+
+    chunk_size = args.chunk_size if args.stream else None
+
     texts = Path('.').absolute() / 'texts'
     output = Path('.').absolute() / 'output'
     output.mkdir(exist_ok=True)
 
-    for filename in texts.rglob('*'):
-        with open(filename, 'r', encoding='utf-8') as file:
-            with open(output / filename.name, 'w', encoding='utf-8') as output_file:
-                output_file.write(to_phonetic_transcription(file.read()))
+    filenames = [filename for filename in texts.rglob('*') if filename.is_file()]
+
+    # Compare inputs to the manifest of previous runs, it's kept out of output so no input can overwrite it
+    manifest_path = Path('.').absolute() / 'output_manifest.json'
+    manifest = load_manifest(manifest_path)
+    pipeline_version = get_pipeline_version()
+
+    # Outputs mirror folders of texts, so files with the same name don't overwrite each other
+    entries = {}
+    to_process = []
+    for filename in filenames:
+        relative_path = filename.relative_to(texts).as_posix()
+        entry = {
+            'md5': get_file_md5(filename),
+            'pipeline': pipeline_version
+        }
+        entries[relative_path] = entry
+
+        if args.process_all or manifest.get(relative_path) != entry or not (output / relative_path).exists():
+            to_process.append(filename)
+
+    # Remove outputs of inputs that don't exist anymore
+    for relative_path in list(manifest):
+        if relative_path not in entries:
+            (output / relative_path).unlink(missing_ok=True)
+            del manifest[relative_path]
+            print(f'Removed {relative_path}')
+
+    print(f'{len(to_process)} of {len(filenames)} files to transcribe')
+
+    try:
+        if args.batch:
+            if to_process:
+                for filename in transcribe_corpus(to_process, texts, output, args.workers, args.batch_size, chunk_size):
+                    relative_path = filename.relative_to(texts).as_posix()
+                    manifest[relative_path] = entries[relative_path]
+        else:
+            for filename in to_process:
+                relative_path = filename.relative_to(texts).as_posix()
+                transcribe_file(filename, output / relative_path, chunk_size)
+                manifest[relative_path] = entries[relative_path]
+    finally:
+        save_manifest(manifest_path, manifest)
     # text = text.replace('\n', ' ')
     # transcription = to_phonetic_transcription(text)
 
@@ -1,2 +1,16 @@
+import hashlib
+from pathlib import Path
+
+
 def string_index_replace(text: str, index: int, to_insert: str) -> str:
     return text[:index] + to_insert + text[index+1:]
+
+
+def get_file_md5(path: Path) -> str:
+    md5 = hashlib.md5()
+
+    with open(path, mode="rb") as file:
+        while chunk := file.read(1024 * 1024):
+            md5.update(chunk)
+    
+    return md5.hexdigest()